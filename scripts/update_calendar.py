@@ -4,135 +4,265 @@ Scrape Bandcamp Friday dates from isitbandcampfriday.com and update the ICS file
 Keeps all previous events intact.
 """
 
+import os
 import re
-import json
-import html
+import html.parser
+import codecs
 import datetime
 import requests
-from bs4 import BeautifulSoup
-from typing import List, Tuple
+import orjson
+from typing import Iterable, List, Optional, Tuple
 
 ICS_FILE = 'bandcamp-friday.ics'
+ETAG_FILE = 'bandcamp-friday.etag'
 SOURCE_URL = 'https://isitbandcampfriday.com/'
 
-def scrape_dates() -> List[str]:
-    """Scrape upcoming Bandcamp Friday dates from the website."""
+# Shared session for connection pooling and default headers. A connection only
+# goes back to the pool once its response body is fully read; scrape_dates
+# stops reading early and closes the response, which drops that connection.
+# requests already advertises every Content-Encoding it can decode.
+SESSION = requests.Session()
+# (connect, read) timeouts in seconds
+REQUEST_TIMEOUT = (5, 15)
+READ_CHUNK_SIZE = 16 * 1024
+
+DTSTAMP_FORMAT = '%Y%m%dT%H%M%SZ'
+
+VM_ID = 'bandcamp-friday-vm'
+# Upper bound on markup the parser may hold back unfinished, e.g. a start tag
+# whose attribute value never closes
+MAX_PENDING_MARKUP_CHARS = 512 * 1024
+
+UID_PREFIX = 'UID:bandcamp-friday-'
+UID_SUFFIX = '@github.com'
+
+# Static lines are joined once here; generate_vevent only fills in the fields
+VEVENT_TEMPLATE = '\r\n'.join((
+    'BEGIN:VEVENT',
+    'UID:{uid}',
+    'DTSTAMP:{dtstamp}',
+    'DTSTART;TZID=America/Los_Angeles:{dtstart}',
+    'DTEND;TZID=America/Los_Angeles:{dtend}',
+    'SUMMARY:Bandcamp Friday',
+    'DESCRIPTION:Bandcamp waives its revenue share on this day. Support artists',
+    '  directly!\\n\\nhttps://isitbandcampfriday.com/',
+    'URL:https://isitbandcampfriday.com/',
+    'STATUS:CONFIRMED',
+    'TRANSP:TRANSPARENT',
+    'END:VEVENT',
+))
+
+MONTHS = {name: f'{number:02d}' for number, name in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+     'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), start=1)}
+WEEKDAYS = frozenset(('Mon,', 'Tue,', 'Wed,', 'Thu,', 'Fri,', 'Sat,', 'Sun,'))
+TIME_RE = re.compile(r'(?:[01]\d|2[0-3]):[0-5]\d:[0-5]\d')
+OFFSET_RE = re.compile(r'[+-]\d{4}')
+
+class FundraisersParser(html.parser.HTMLParser):
+    """Records data-fundraisers from the first bandcamp-friday-vm div start tag."""
+
+    def __init__(self):
+        super().__init__()
+        self.found_div = False
+        self.fundraisers = None
+
+    def handle_starttag(self, tag, attrs):
+        if self.found_div or tag != 'div':
+            return
+        # As in HTML, the first occurrence of a repeated attribute wins
+        attrs = dict(reversed(attrs))
+        if attrs.get('id') == VM_ID:
+            self.found_div = True
+            self.fundraisers = attrs.get('data-fundraisers')
+
+def find_fundraisers_attr(chunks: Iterable[bytes]) -> Optional[str]:
+    """Feed HTML chunks to FundraisersParser until the bandcamp-friday-vm div turns up.
+
+    Returns its data-fundraisers attribute (entities already decoded), or
+    None if the div or attribute is missing. The stdlib parser skips
+    comments and script bodies and handles quoting, but builds no tree, and
+    chunks stop being consumed as soon as the div's start tag has been
+    parsed. Gives up once more than MAX_PENDING_MARKUP_CHARS of unfinished
+    markup are held back.
+    """
+    parser = FundraisersParser()
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    for chunk in chunks:
+        parser.feed(decoder.decode(chunk))
+        if parser.found_div:
+            return parser.fundraisers
+        # rawdata is whatever the parser couldn't finish yet
+        if len(parser.rawdata) > MAX_PENDING_MARKUP_CHARS:
+            print("data-fundraisers attribute exceeds size limit")
+            return None
+    return None
+
+def parse_fundraiser_date(date_str: str) -> str:
+    """Convert a date like "Fri, 03 Oct 2025 07:00:00 -0000" to YYYYMMDD.
+
+    The source always uses this fixed RFC 2822 shape, so split it by hand
+    rather than paying for a strptime call per fundraiser. Every field must
+    match that shape exactly, with a 1-2 digit day and a 4 digit year;
+    anything else raises ValueError.
+    """
+    parts = date_str.split()
+    if len(parts) != 6:
+        raise ValueError(f"unrecognised date format: {date_str!r}")
+    weekday, day, month_name, year, time, offset = parts
+    if (weekday not in WEEKDAYS or month_name not in MONTHS
+            or not (day.isascii() and day.isdigit() and 1 <= len(day) <= 2)
+            or not (year.isascii() and year.isdigit() and len(year) == 4)
+            or not TIME_RE.fullmatch(time) or not OFFSET_RE.fullmatch(offset)):
+        raise ValueError(f"unrecognised date format: {date_str!r}")
+    month = MONTHS[month_name]
+    # date() rejects impossible days like 31 Feb
+    datetime.date(int(year), int(month), int(day))
+    return f'{int(year):04d}{month}{int(day):02d}'
+
+def read_etag() -> Optional[str]:
+    """Read the ETag saved from the last successful scrape, if any."""
     try:
-        response = requests.get(SOURCE_URL, timeout=10)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
+        with open(ETAG_FILE, 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def write_etag(etag: str):
+    """Save the source page's ETag for the next run's conditional request."""
+    with open(ETAG_FILE, 'w', encoding='utf-8') as f:
+        f.write(f'{etag}\n')
 
-        # Find the div with data-fundraisers attribute
-        bandcamp_vm = soup.find('div', id='bandcamp-friday-vm')
-        if not bandcamp_vm or not bandcamp_vm.get('data-fundraisers'):
+def scrape_dates() -> Tuple[Optional[List[str]], Optional[str]]:
+    """Scrape upcoming Bandcamp Friday dates from the website.
+
+    Sends the ETag from the previous run, so an unchanged page costs a bodyless
+    304 response and no parsing. Returns (dates, etag), where dates is None in
+    that case, to tell it apart from a page that yielded no dates. The new
+    ETag is left for the caller to save once the calendar is up to date.
+    """
+    try:
+        headers = {}
+        prior_etag = read_etag()
+        if prior_etag:
+            headers['If-None-Match'] = prior_etag
+
+        response = SESSION.get(SOURCE_URL, headers=headers, stream=True, timeout=REQUEST_TIMEOUT)
+        try:
+            if response.status_code == 304:
+                print("Source page not modified since last run.")
+                return None, None
+            response.raise_for_status()
+            etag = response.headers.get('ETag')
+            # Parse as the body arrives; the rest of the page is never read
+            fundraisers_attr = find_fundraisers_attr(response.iter_content(chunk_size=READ_CHUNK_SIZE))
+        finally:
+            # The body is left unread, so this closes the socket rather than
+            # returning it to SESSION's pool
+            response.close()
+
+        if not fundraisers_attr:
             print("Could not find data-fundraisers attribute")
-            return []
+            return [], None
 
-        # Parse the JSON data (it's HTML-encoded)
-        fundraisers_json = html.unescape(bandcamp_vm['data-fundraisers'])
-        fundraisers = json.loads(fundraisers_json)
+        # Parse the JSON data
+        fundraisers = orjson.loads(fundraisers_attr)
 
         # Extract dates from the fundraiser objects
-        dates = []
+        # A set drops duplicates as we go; sorting happens once at the end
+        dates = set()
         for fundraiser in fundraisers:
             try:
                 # Parse date string like "Fri, 03 Oct 2025 07:00:00 -0000"
-                date_str = fundraiser['date']
-                dt = datetime.datetime.strptime(date_str, '%a, %d %b %Y %H:%M:%S %z')
-                date_formatted = dt.strftime('%Y%m%d')
-                if date_formatted not in dates:
-                    dates.append(date_formatted)
+                dates.add(parse_fundraiser_date(fundraiser['date']))
             except Exception as e:
                 print(f"Error parsing date {fundraiser.get('date')}: {e}")
                 continue
 
-        return sorted(set(dates))
+        return sorted(dates), etag
     except Exception as e:
         print(f"Error scraping dates: {e}")
-        return []
+        return [], None
 
-def read_existing_ics() -> Tuple[str, List[str]]:
-    """Read the existing ICS file and extract existing event UIDs."""
-    try:
-        with open(ICS_FILE, 'r') as f:
-            content = f.read()
+def read_existing_ics() -> Tuple[Optional[str], List[str]]:
+    """Read the existing ICS file and extract the unique dates of its events, in file order.
 
-        # Extract all existing event UIDs
-        uid_pattern = r'UID:(bandcamp-friday-\d{8}@github\.com)'
-        existing_uids = re.findall(uid_pattern, content)
+    The content is returned with its line endings normalized to CRLF. Both
+    jobs happen in the same single pass over the file's lines.
+    """
+    # UIDs look like "UID:bandcamp-friday-YYYYMMDD@github.com", so the
+    # date sits at a fixed offset and no regex is needed
+    date_start = len(UID_PREFIX)
+    date_end = date_start + 8
+    try:
+        lines = []
+        # A dict keeps the first occurrence of each date, in order
+        existing_dates = {}
+        with open(ICS_FILE, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.rstrip('\r\n')
+                lines.append(line)
+                if (line.startswith(UID_PREFIX)
+                        and line[date_start:date_end].isdigit()
+                        and line.startswith(UID_SUFFIX, date_end)):
+                    existing_dates[line[date_start:date_end]] = None
 
-        return content, existing_uids
+        # One C-level join rather than a string per line
+        content = '\r\n'.join(lines) + '\r\n' if lines else ''
+        return content, list(existing_dates)
     except FileNotFoundError:
         return None, []
 
-def generate_vevent(date_str: str) -> str:
-    """Generate a VEVENT block for a given date in Pacific time."""
-    dt = datetime.datetime.strptime(date_str, '%Y%m%d')
+def current_dtstamp() -> str:
+    """Return the current UTC time formatted for a DTSTAMP property."""
+    return datetime.datetime.now(datetime.UTC).strftime(DTSTAMP_FORMAT)
+
+def generate_vevent(date_str: str, dtstamp: Optional[str] = None) -> str:
+    """Generate a VEVENT block for a given date in Pacific time.
 
+    Pass dtstamp when generating a batch so every event shares one timestamp
+    instead of reading the clock per event.
+    """
     uid = f"bandcamp-friday-{date_str}@github.com"
-    dtstamp = datetime.datetime.now(datetime.UTC).strftime('%Y%m%dT%H%M%SZ')
-    dtstart = dt.strftime('%Y%m%dT000000')
-    dtend = dt.strftime('%Y%m%dT235959')
-
-    return f"""BEGIN:VEVENT\r
-UID:{uid}\r
-DTSTAMP:{dtstamp}\r
-DTSTART;TZID=America/Los_Angeles:{dtstart}\r
-DTEND;TZID=America/Los_Angeles:{dtend}\r
-SUMMARY:Bandcamp Friday\r
-DESCRIPTION:Bandcamp waives its revenue share on this day. Support artists\r
-  directly!\\n\\nhttps://isitbandcampfriday.com/\r
-URL:https://isitbandcampfriday.com/\r
-STATUS:CONFIRMED\r
-TRANSP:TRANSPARENT\r
-END:VEVENT"""
+    if dtstamp is None:
+        dtstamp = current_dtstamp()
+    # date_str is already YYYYMMDD, so the event spans that whole local day
+    dtstart = f'{date_str}T000000'
+    dtend = f'{date_str}T235959'
+
+    return VEVENT_TEMPLATE.format(uid=uid, dtstamp=dtstamp, dtstart=dtstart, dtend=dtend)
 
 def update_ics_file(new_dates: List[str]):
     """Update the ICS file with new dates while preserving existing events."""
-    content, existing_uids = read_existing_ics()
-
-    # Extract existing dates from UIDs (preserving order)
-    existing_dates_ordered = []
-    seen = set()
-    for uid in existing_uids:
-        match = re.search(r'bandcamp-friday-(\d{8})', uid)
-        if match:
-            date = match.group(1)
-            if date not in seen:
-                existing_dates_ordered.append(date)
-                seen.add(date)
+    content, existing_dates = read_existing_ics()
 
     # Find new dates to add
-    dates_to_add = [d for d in new_dates if d not in seen]
-
-    # Combine all dates and sort
-    all_dates = sorted(existing_dates_ordered + dates_to_add)
+    existing = set(existing_dates)
+    dates_to_add = [d for d in new_dates if d not in existing]
 
     if not dates_to_add:
         print("No new dates to add.")
-        # Still check if we need to reorder existing events
-        if content and existing_dates_ordered == sorted(existing_dates_ordered):
+        # Steady state for scheduled runs: every date is already present and in
+        # order, so bail out before sorting or rebuilding anything. A single
+        # linear pass is enough to confirm the order.
+        in_order = all(a < b for a, b in zip(existing_dates, existing_dates[1:]))
+        if content and in_order:
             return
         print("Reordering existing events by date.")
-
-    if dates_to_add:
+    else:
         print(f"Adding {len(dates_to_add)} new dates: {dates_to_add}")
 
-    # If we have existing content, rebuild with sorted events
+    # Combine all dates and sort
+    all_dates = sorted(existing_dates + dates_to_add)
+
+    # Keep the existing calendar header if we have one
     if content:
-        # Normalize line endings to CRLF
-        content = content.replace('\r\n', '\n').replace('\n', '\r\n')
-        # Extract everything before the first VEVENT
-        header_match = re.search(r'(.*?)BEGIN:VEVENT', content, re.DOTALL)
-        if header_match:
-            header = header_match.group(1)
-        else:
-            # Fallback: use everything up to END:VCALENDAR
-            header = content.replace('END:VCALENDAR', '')
-
-        # Generate all events in sorted order
-        events = '\r\n'.join(generate_vevent(d) for d in all_dates)
-        new_content = f'{header}{events}\r\nEND:VCALENDAR\r\n'
+        # Extract everything before the first VEVENT, falling back to
+        # everything up to the closing END:VCALENDAR
+        header_end = content.find('BEGIN:VEVENT')
+        if header_end == -1:
+            header_end = content.rfind('END:VCALENDAR')
+        header = content[:header_end] if header_end != -1 else content
     else:
         # Create new ICS from scratch
         header = """BEGIN:VCALENDAR\r
@@ -161,20 +291,52 @@ TZNAME:PST\r
 END:STANDARD\r
 END:VTIMEZONE\r
 """
-        events = '\r\n'.join(generate_vevent(d) for d in new_dates)
-        new_content = f"{header}{events}\r\nEND:VCALENDAR\r\n"
 
-    with open(ICS_FILE, 'w') as f:
-        f.write(new_content)
+    # Assemble the file in a single join, with all events in sorted order
+    dtstamp = current_dtstamp()
+    parts = [header]
+    for d in all_dates:
+        parts.append(generate_vevent(d, dtstamp))
+        parts.append('\r\n')
+    parts.append('END:VCALENDAR\r\n')
+
+    # Write to a temp file and rename it over the calendar, so a crash mid-write
+    # can never leave a truncated ICS file behind
+    tmp_file = f'{ICS_FILE}.tmp'
+    # Binary mode skips newline translation and the text codec layer; the
+    # content already has the CRLF endings RFC 5545 requires
+    try:
+        with open(tmp_file, 'wb', buffering=65536) as f:
+            f.write(''.join(parts).encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, ICS_FILE)
+    except Exception:
+        # Don't leave a partial temp file behind for the next run to trip over
+        try:
+            os.unlink(tmp_file)
+        except FileNotFoundError:
+            pass
+        raise
 
     print(f"Updated {ICS_FILE}")
 
-if __name__ == '__main__':
+def main():
+    """Scrape the site and update the calendar, then save the page's ETag."""
     print(f"Scraping Bandcamp Friday dates from {SOURCE_URL}...")
-    dates = scrape_dates()
+    dates, etag = scrape_dates()
 
-    if dates:
+    if dates is None:
+        # Nothing can have changed, so don't even read the calendar
+        print("Calendar already up to date.")
+    elif dates:
         print(f"Found {len(dates)} dates: {dates}")
         update_ics_file(dates)
+        # Only remember the page once its dates are safely in the calendar
+        if etag:
+            write_etag(etag)
     else:
         print("No dates found. Calendar not updated.")
+
+if __name__ == '__main__':
+    main()
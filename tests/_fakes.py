@@ -0,0 +1,31 @@
+"""
+Lightweight stand-ins for objects the tests would otherwise build with Mock.
+"""
+
+from typing import Dict, Iterator, Optional
+
+import requests
+
+
+class FakeResponse:
+    """Minimal streamed requests.Response serving a fixed body."""
+
+    def __init__(self, content: bytes = b'', status_code: int = 200,
+                 headers: Optional[Dict[str, str]] = None):
+        self.content = content
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.body_read = False
+        self.closed = False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error")
+
+    def iter_content(self, chunk_size: int = 1) -> Iterator[bytes]:
+        self.body_read = True
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        self.closed = True
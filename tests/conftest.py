@@ -0,0 +1,9 @@
+"""
+Shared pytest configuration for the update_calendar tests.
+"""
+
+import sys
+import os
+
+# Add scripts directory to path once, so test modules can import update_calendar
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
@@ -4,150 +4,348 @@ Tests for update_calendar.py script.
 """
 
 import datetime
-from unittest.mock import Mock, mock_open, patch
-import sys
-import os
+import pytest
+from unittest.mock import mock_open, patch
 
-# Add scripts directory to path so we can import the module
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
 import update_calendar
+# Bound before the autouse stubs below, for the tests of the real functions
+from update_calendar import read_etag, write_etag
+from tests._fakes import FakeResponse
+
+
+@pytest.fixture(autouse=True)
+def mock_fsync(mocker):
+    """Keep update_ics_file's fsync away from the real filesystem."""
+    return mocker.patch('update_calendar.os.fsync')
+
+
+@pytest.fixture(autouse=True)
+def mock_replace(mocker):
+    """Keep update_ics_file's rename away from the real filesystem."""
+    return mocker.patch('update_calendar.os.replace')
+
+
+@pytest.fixture(autouse=True)
+def mock_etag(mocker):
+    """Keep scrape_dates and main away from the real ETag file."""
+    mocker.patch('update_calendar.read_etag', return_value=None)
+    mocker.patch('update_calendar.write_etag')
+
+
+# Page layout matching actual isitbandcampfriday.com; {attr} is the quoted
+# data-fundraisers value
+PAGE_TEMPLATE = '''
+<html>
+    <div id="bandcamp-friday-vm"
+        class="pane"
+        data-fundraisers={attr}
+        data-is-dev="false">
+    </div>
+</html>
+'''
+
+
+@pytest.fixture(scope='module')
+def make_response():
+    """Build a FakeResponse serving PAGE_TEMPLATE with the given attribute value."""
+    def _make_response(attr):
+        return FakeResponse(PAGE_TEMPLATE.format(attr=attr).encode())
+    return _make_response
 
 
 class TestScrapeDates:
     """Tests for scrape_dates function."""
 
-    def test_scrape_dates_success(self, mocker):
-        """Test successful scraping of dates from website."""
-        # Mock HTML response matching actual isitbandcampfriday.com format
-        mock_html = '''
-        <html>
-            <div id="bandcamp-friday-vm"
-                class="pane"
-                data-fundraisers="[{&quot;date&quot;:&quot;Fri, 03 Oct 2025 07:00:00 -0000&quot;,&quot;url&quot;:&quot;https://daily.bandcamp.com/features/bandcamp-fridays&quot;,&quot;zero_revshare&quot;:true,&quot;display&quot;:&quot;October 3rd, 2025&quot;},{&quot;date&quot;:&quot;Fri, 07 Nov 2025 08:00:00 -0000&quot;,&quot;url&quot;:&quot;https://daily.bandcamp.com/features/bandcamp-fridays&quot;,&quot;zero_revshare&quot;:true,&quot;display&quot;:&quot;November 7th, 2025&quot;},{&quot;date&quot;:&quot;Fri, 05 Dec 2025 08:00:00 -0000&quot;,&quot;url&quot;:&quot;https://daily.bandcamp.com/features/bandcamp-fridays&quot;,&quot;zero_revshare&quot;:true,&quot;display&quot;:&quot;December 5th, 2025&quot;}]"
-                data-is-dev="false">
-            </div>
-        </html>
-        '''
+    @pytest.mark.parametrize('attr, expected', [
+        pytest.param(
+            '"[{&quot;date&quot;:&quot;Fri, 03 Oct 2025 07:00:00 -0000&quot;,&quot;url&quot;:&quot;https://daily.bandcamp.com/features/bandcamp-fridays&quot;,&quot;zero_revshare&quot;:true,&quot;display&quot;:&quot;October 3rd, 2025&quot;},{&quot;date&quot;:&quot;Fri, 07 Nov 2025 08:00:00 -0000&quot;,&quot;url&quot;:&quot;https://daily.bandcamp.com/features/bandcamp-fridays&quot;,&quot;zero_revshare&quot;:true,&quot;display&quot;:&quot;November 7th, 2025&quot;},{&quot;date&quot;:&quot;Fri, 05 Dec 2025 08:00:00 -0000&quot;,&quot;url&quot;:&quot;https://daily.bandcamp.com/features/bandcamp-fridays&quot;,&quot;zero_revshare&quot;:true,&quot;display&quot;:&quot;December 5th, 2025&quot;}]"',
+            ['20251003', '20251107', '20251205'], id='success'),
+        pytest.param(
+            '"[{&quot;date&quot;:&quot;Fri, 03 Oct 2025 07:00:00 -0000&quot;,&quot;url&quot;:&quot;https://daily.bandcamp.com/features/bandcamp-fridays&quot;,&quot;zero_revshare&quot;:true,&quot;display&quot;:&quot;October 3rd, 2025&quot;}]"',
+            ['20251003'], id='html_encoded'),
+        pytest.param(
+            '"[{&quot;date&quot;:&quot;Fri, 03 Oct 2025 07:00:00 -0000&quot;,&quot;url&quot;:&quot;https://daily.bandcamp.com/features/bandcamp-fridays&quot;,&quot;zero_revshare&quot;:true,&quot;display&quot;:&quot;October 3rd, 2025&quot;},{&quot;date&quot;:&quot;Fri, 03 Oct 2025 07:00:00 -0000&quot;,&quot;url&quot;:&quot;https://daily.bandcamp.com/features/bandcamp-fridays&quot;,&quot;zero_revshare&quot;:true,&quot;display&quot;:&quot;October 3rd, 2025&quot;}]"',
+            ['20251003'], id='duplicate_removal'),
+        # Should skip invalid date but process valid one
+        pytest.param(
+            '"[{&quot;date&quot;:&quot;Invalid date format&quot;,&quot;url&quot;:&quot;https://daily.bandcamp.com/features/bandcamp-fridays&quot;,&quot;zero_revshare&quot;:true,&quot;display&quot;:&quot;Invalid&quot;},{&quot;date&quot;:&quot;Fri, 03 Oct 2025 07:00:00 -0000&quot;,&quot;url&quot;:&quot;https://daily.bandcamp.com/features/bandcamp-fridays&quot;,&quot;zero_revshare&quot;:true,&quot;display&quot;:&quot;October 3rd, 2025&quot;}]"',
+            ['20251003'], id='invalid_date_format'),
+        pytest.param("'invalid json'", [], id='invalid_json'),
+    ])
+    def test_scrape_dates(self, mocker, make_response, attr, expected):
+        """Test scraping dates from the data-fundraisers payload."""
+        mocker.patch('update_calendar.SESSION.get', return_value=make_response(attr))
 
-        mock_response = Mock()
-        mock_response.content = mock_html.encode()
-        mock_response.raise_for_status = Mock()
+        dates, _ = update_calendar.scrape_dates()
 
-        mocker.patch('update_calendar.requests.get', return_value=mock_response)
+        assert dates == expected  # Deduplicated and sorted
 
-        dates = update_calendar.scrape_dates()
+    def test_scrape_dates_missing_attribute(self, mocker):
+        """Test handling when data-fundraisers attribute is missing."""
+        mock_html = '<html><body>No data here</body></html>'
 
-        assert len(dates) == 3
-        assert '20251003' in dates
-        assert '20251107' in dates
-        assert '20251205' in dates
-        assert dates == sorted(dates)  # Should be sorted
+        mocker.patch('update_calendar.SESSION.get', return_value=FakeResponse(mock_html.encode()))
 
-    def test_scrape_dates_html_encoded(self, mocker):
-        """Test handling of HTML-encoded JSON data."""
-        # Mock HTML with HTML-encoded JSON matching real format
-        mock_html = '''
-        <html>
-            <div id="bandcamp-friday-vm"
-                data-fundraisers="[{&quot;date&quot;:&quot;Fri, 03 Oct 2025 07:00:00 -0000&quot;,&quot;url&quot;:&quot;https://daily.bandcamp.com/features/bandcamp-fridays&quot;,&quot;zero_revshare&quot;:true,&quot;display&quot;:&quot;October 3rd, 2025&quot;}]">
-            </div>
-        </html>
-        '''
+        assert update_calendar.scrape_dates() == ([], None)
 
-        mock_response = Mock()
-        mock_response.content = mock_html.encode()
-        mock_response.raise_for_status = Mock()
+    def test_scrape_dates_network_error(self, mocker):
+        """Test handling of network errors."""
+        mocker.patch('update_calendar.SESSION.get', side_effect=Exception("Network error"))
 
-        mocker.patch('update_calendar.requests.get', return_value=mock_response)
+        assert update_calendar.scrape_dates() == ([], None)
 
-        dates = update_calendar.scrape_dates()
 
-        assert len(dates) == 1
-        assert '20251003' in dates
+class TestConditionalFetch:
+    """Tests for the ETag-based conditional request in scrape_dates."""
 
-    def test_scrape_dates_duplicate_removal(self, mocker):
-        """Test that duplicate dates are removed."""
-        mock_html = '''
-        <html>
-            <div id="bandcamp-friday-vm"
-                data-fundraisers="[{&quot;date&quot;:&quot;Fri, 03 Oct 2025 07:00:00 -0000&quot;,&quot;url&quot;:&quot;https://daily.bandcamp.com/features/bandcamp-fridays&quot;,&quot;zero_revshare&quot;:true,&quot;display&quot;:&quot;October 3rd, 2025&quot;},{&quot;date&quot;:&quot;Fri, 03 Oct 2025 07:00:00 -0000&quot;,&quot;url&quot;:&quot;https://daily.bandcamp.com/features/bandcamp-fridays&quot;,&quot;zero_revshare&quot;:true,&quot;display&quot;:&quot;October 3rd, 2025&quot;}]">
-            </div>
-        </html>
-        '''
+    mock_html = (
+        '<html><div id="bandcamp-friday-vm" data-fundraisers="[{&quot;date&quot;:'
+        '&quot;Fri, 03 Oct 2025 07:00:00 -0000&quot;}]"></div></html>'
+    )
 
-        mock_response = Mock()
-        mock_response.content = mock_html.encode()
-        mock_response.raise_for_status = Mock()
+    def test_sends_prior_etag(self, mocker):
+        """Test that the saved ETag is sent as If-None-Match."""
+        mocker.patch('update_calendar.read_etag', return_value='"abc"')
+        mock_get = mocker.patch('update_calendar.SESSION.get',
+                                return_value=FakeResponse(status_code=304))
 
-        mocker.patch('update_calendar.requests.get', return_value=mock_response)
+        update_calendar.scrape_dates()
 
-        dates = update_calendar.scrape_dates()
+        assert mock_get.call_args.kwargs['headers'] == {'If-None-Match': '"abc"'}
 
-        assert len(dates) == 1
-        assert '20251003' in dates
+    def test_uses_session_with_timeouts(self, mocker):
+        """Test that the fetch goes through the shared session with explicit timeouts."""
+        mock_get = mocker.patch('update_calendar.SESSION.get',
+                                return_value=FakeResponse(status_code=304))
 
-    def test_scrape_dates_missing_attribute(self, mocker):
-        """Test handling when data-fundraisers attribute is missing."""
-        mock_html = '<html><body>No data here</body></html>'
+        update_calendar.scrape_dates()
 
-        mock_response = Mock()
-        mock_response.content = mock_html.encode()
-        mock_response.raise_for_status = Mock()
+        assert mock_get.call_args.args == (update_calendar.SOURCE_URL,)
+        assert mock_get.call_args.kwargs['stream'] is True
+        assert mock_get.call_args.kwargs['timeout'] == update_calendar.REQUEST_TIMEOUT
 
-        mocker.patch('update_calendar.requests.get', return_value=mock_response)
+    def test_no_etag_sends_plain_request(self, mocker):
+        """Test that no conditional header is sent without a saved ETag."""
+        mock_get = mocker.patch('update_calendar.SESSION.get',
+                                return_value=FakeResponse(status_code=304))
 
-        dates = update_calendar.scrape_dates()
+        update_calendar.scrape_dates()
 
-        assert dates == []
+        assert mock_get.call_args.kwargs['headers'] == {}
 
-    def test_scrape_dates_invalid_json(self, mocker):
-        """Test handling of invalid JSON data."""
-        mock_html = '''
-        <html>
-            <div id="bandcamp-friday-vm" data-fundraisers='invalid json'>
-            </div>
-        </html>
-        '''
+    def test_not_modified_skips_parsing(self, mocker, capsys):
+        """Test that a 304 response returns None without reading a body."""
+        mocker.patch('update_calendar.read_etag', return_value='"abc"')
+        mock_write = mocker.patch('update_calendar.write_etag')
+        response = FakeResponse(status_code=304)
+        mocker.patch('update_calendar.SESSION.get', return_value=response)
 
-        mock_response = Mock()
-        mock_response.content = mock_html.encode()
-        mock_response.raise_for_status = Mock()
+        assert update_calendar.scrape_dates() == (None, None)
+        assert not response.body_read
+        assert response.closed
+        mock_write.assert_not_called()
+        assert 'not modified' in capsys.readouterr().out
 
-        mocker.patch('update_calendar.requests.get', return_value=mock_response)
+    def test_returns_new_etag(self, mocker):
+        """Test that the new ETag is returned to the caller rather than saved."""
+        mock_write = mocker.patch('update_calendar.write_etag')
+        mocker.patch('update_calendar.SESSION.get',
+                     return_value=FakeResponse(self.mock_html.encode(), headers={'ETag': '"def"'}))
 
-        dates = update_calendar.scrape_dates()
+        assert update_calendar.scrape_dates() == (['20251003'], '"def"')
+        mock_write.assert_not_called()
 
-        assert dates == []
+    def test_read_etag(self, mocker):
+        """Test reading a saved ETag."""
+        mock_file = mock_open(read_data='"abc"\n')
+        mocker.patch('builtins.open', mock_file)
 
-    def test_scrape_dates_network_error(self, mocker):
-        """Test handling of network errors."""
-        mocker.patch('update_calendar.requests.get', side_effect=Exception("Network error"))
+        assert read_etag() == '"abc"'
+        mock_file.assert_called_once_with(update_calendar.ETAG_FILE, 'r', encoding='utf-8')
 
-        dates = update_calendar.scrape_dates()
+    def test_read_etag_missing(self, mocker):
+        """Test that a missing ETag file reads as None."""
+        mocker.patch('builtins.open', side_effect=FileNotFoundError)
 
-        assert dates == []
+        assert read_etag() is None
 
-    def test_scrape_dates_invalid_date_format(self, mocker):
-        """Test handling of invalid date formats."""
-        mock_html = '''
-        <html>
-            <div id="bandcamp-friday-vm"
-                data-fundraisers="[{&quot;date&quot;:&quot;Invalid date format&quot;,&quot;url&quot;:&quot;https://daily.bandcamp.com/features/bandcamp-fridays&quot;,&quot;zero_revshare&quot;:true,&quot;display&quot;:&quot;Invalid&quot;},{&quot;date&quot;:&quot;Fri, 03 Oct 2025 07:00:00 -0000&quot;,&quot;url&quot;:&quot;https://daily.bandcamp.com/features/bandcamp-fridays&quot;,&quot;zero_revshare&quot;:true,&quot;display&quot;:&quot;October 3rd, 2025&quot;}]">
-            </div>
-        </html>
-        '''
+    def test_write_etag(self, mocker):
+        """Test saving an ETag."""
+        mock_file = mock_open()
+        mocker.patch('builtins.open', mock_file)
 
-        mock_response = Mock()
-        mock_response.content = mock_html.encode()
-        mock_response.raise_for_status = Mock()
+        write_etag('"abc"')
 
-        mocker.patch('update_calendar.requests.get', return_value=mock_response)
+        mock_file.assert_called_once_with(update_calendar.ETAG_FILE, 'w', encoding='utf-8')
+        mock_file().write.assert_called_once_with('"abc"\n')
 
-        dates = update_calendar.scrape_dates()
 
-        # Should skip invalid date but process valid one
-        assert len(dates) == 1
-        assert '20251003' in dates
+class TestMain:
+    """Tests for the main entry point."""
+
+    def test_saves_etag_after_update(self, mocker):
+        """Test that the ETag is saved once the calendar has been updated."""
+        mocker.patch('update_calendar.scrape_dates', return_value=(['20251003'], '"def"'))
+        mock_update = mocker.patch('update_calendar.update_ics_file')
+        mock_write = mocker.patch('update_calendar.write_etag')
+
+        update_calendar.main()
+
+        mock_update.assert_called_once_with(['20251003'])
+        mock_write.assert_called_once_with('"def"')
+
+    def test_etag_not_saved_when_update_fails(self, mocker):
+        """Test that a failed calendar update leaves the next run to refetch."""
+        mocker.patch('update_calendar.scrape_dates', return_value=(['20251003'], '"def"'))
+        mocker.patch('update_calendar.update_ics_file', side_effect=OSError("disk full"))
+        mock_write = mocker.patch('update_calendar.write_etag')
+
+        with pytest.raises(OSError):
+            update_calendar.main()
+
+        mock_write.assert_not_called()
+
+    def test_etag_not_saved_without_dates(self, mocker):
+        """Test that a page yielding no dates doesn't suppress the next fetch."""
+        mocker.patch('update_calendar.scrape_dates', return_value=([], '"def"'))
+        mock_update = mocker.patch('update_calendar.update_ics_file')
+        mock_write = mocker.patch('update_calendar.write_etag')
+
+        update_calendar.main()
+
+        mock_update.assert_not_called()
+        mock_write.assert_not_called()
+
+    def test_not_modified_leaves_calendar_alone(self, mocker, capsys):
+        """Test that an unchanged page skips the calendar entirely."""
+        mocker.patch('update_calendar.scrape_dates', return_value=(None, None))
+        mock_update = mocker.patch('update_calendar.update_ics_file')
+        mock_write = mocker.patch('update_calendar.write_etag')
+
+        update_calendar.main()
+
+        mock_update.assert_not_called()
+        mock_write.assert_not_called()
+        assert 'already up to date' in capsys.readouterr().out
+
+
+class TestParseFundraiserDate:
+    """Tests for parse_fundraiser_date function."""
+
+    def test_parse_fundraiser_date(self):
+        """Test conversion of the source date format to YYYYMMDD."""
+        assert update_calendar.parse_fundraiser_date('Fri, 03 Oct 2025 07:00:00 -0000') == '20251003'
+        assert update_calendar.parse_fundraiser_date('Fri, 5 Dec 2025 08:00:00 -0000') == '20251205'
+
+    def test_parse_fundraiser_date_matches_strptime(self):
+        """Test that the hand parser agrees with strptime."""
+        date_str = 'Fri, 07 Nov 2025 08:00:00 -0000'
+        expected = datetime.datetime.strptime(date_str, '%a, %d %b %Y %H:%M:%S %z').strftime('%Y%m%d')
+
+        assert update_calendar.parse_fundraiser_date(date_str) == expected
+
+    def test_parse_fundraiser_date_invalid(self):
+        """Test that malformed and impossible dates raise ValueError."""
+        for date_str in ('Invalid date format', 'Fri, 03 Foo 2025 07:00:00 -0000',
+                         'Fri, 31 Feb 2025 07:00:00 -0000', 'Fri, xx Oct 2025 07:00:00 -0000',
+                         'Xyz, 03 Oct 2025 garbage nonsense', 'Fri 03 Oct 2025 07:00:00 -0000',
+                         'Fri, 03 Oct 2025 25:00:00 -0000', 'Fri, 03 Oct 2025 07:00 -0000',
+                         'Fri, 03 Oct 2025 07:00:00 GMT', 'Fri, 03 Oct 25 07:00:00 -0000',
+                         'Fri, 003 Oct 2025 07:00:00 -0000', 'Fri, +3 Oct 2025 07:00:00 -0000',
+                         'Fri, 0_3 Oct 2025 07:00:00 -0000', 'Fri, 03 Oct 2_025 07:00:00 -0000',
+                         'Fri, 03 Oct 02025 07:00:00 -0000', 'Fri, 00 Oct 2025 07:00:00 -0000'):
+            with pytest.raises(ValueError):
+                update_calendar.parse_fundraiser_date(date_str)
+
+
+class TestFindFundraisersAttr:
+    """Tests for find_fundraisers_attr function."""
+
+    def test_stops_reading_after_div_found(self):
+        """Test that chunks after the target div are never consumed."""
+        def chunks():
+            yield b'<html><body><p>intro</p>'
+            yield b'<div id="bandcamp-friday-vm" data-fundraisers="[&quot;x&quot;]">'
+            raise AssertionError("read past the target div")
+
+        assert update_calendar.find_fundraisers_attr(chunks()) == '["x"]'
+
+    def test_div_split_across_chunks(self):
+        """Test that a start tag split across chunk boundaries is found."""
+        chunks = [b'<html><div id="bandcamp-fri', b'day-vm" data-fundraisers="[]"></div></html>']
+
+        assert update_calendar.find_fundraisers_attr(chunks) == '[]'
+
+    def test_single_quoted_attribute(self):
+        """Test that a single-quoted attribute value is read."""
+        chunks = [b"<html><div id=\"bandcamp-friday-vm\" data-fundraisers='[&quot;x&quot;]'></div></html>"]
+
+        assert update_calendar.find_fundraisers_attr(chunks) == '["x"]'
+
+    def test_attribute_before_id(self):
+        """Test that data-fundraisers is found when it precedes the id attribute."""
+        chunks = [b'<div data-fundraisers="[1]" id="bandcamp-friday-vm">']
+
+        assert update_calendar.find_fundraisers_attr(chunks) == '[1]'
+
+    def test_unusual_tag_spelling(self):
+        """Test upper-case names, unquoted id and a '>' inside a quoted value."""
+        chunks = [b'<DIV title="a > b" DATA-FUNDRAISERS=\'[2]\' id=bandcamp-friday-vm>']
+
+        assert update_calendar.find_fundraisers_attr(chunks) == '[2]'
+
+    def test_skips_id_mentioned_elsewhere(self):
+        """Test that the id appearing in text or another tag isn't mistaken for the div."""
+        chunks = [b'<p>see #bandcamp-friday-vm</p><a href="#bandcamp-friday-vm">link</a>',
+                  b'<div id="bandcamp-fri', b'day-vm" data-fundraisers="[3]"></div>']
+
+        assert update_calendar.find_fundraisers_attr(chunks) == '[3]'
+
+    def test_skips_commented_out_div(self):
+        """Test that a div inside an HTML comment is ignored."""
+        chunks = [b'<!-- <div id="bandcamp-friday-vm" data-fundraisers="[9]"> -->',
+                  b'<div id="bandcamp-friday-vm" data-fundraisers="[1]">']
+
+        assert update_calendar.find_fundraisers_attr(chunks) == '[1]'
+
+    def test_less_than_in_earlier_attribute(self):
+        """Test that a literal '<' in another attribute value doesn't hide the div."""
+        chunks = [b'<div data-x="a<b" id="bandcamp-friday-vm" data-fundraisers="[1]">']
+
+        assert update_calendar.find_fundraisers_attr(chunks) == '[1]'
+
+    def test_tag_start_split_from_id(self):
+        """Test that a start tag whose '<' arrived in an earlier chunk is still parsed."""
+        chunks = [b'<html><div data-fundraisers="[4]"', b' class="pane"',
+                  b' id="bandcamp-friday-vm"></div>']
+
+        assert update_calendar.find_fundraisers_attr(chunks) == '[4]'
+
+    def test_missing_attribute(self, capsys):
+        """Test that None is returned as soon as the div's tag closes without data-fundraisers."""
+        def chunks():
+            yield b'<html><div id="bandcamp-friday-vm" class="pane"></div>'
+            raise AssertionError("read past the target div")
+
+        assert update_calendar.find_fundraisers_attr(chunks()) is None
+        assert 'size limit' not in capsys.readouterr().out
+
+    def test_gives_up_past_size_limit(self, mocker):
+        """Test that an unterminated attribute stops being buffered at the cap."""
+        mocker.patch('update_calendar.MAX_PENDING_MARKUP_CHARS', 64)
+
+        def chunks():
+            yield b'<div id="bandcamp-friday-vm" data-fundraisers="'
+            yield b'x' * 64
+            raise AssertionError("read past the size limit")
+
+        assert update_calendar.find_fundraisers_attr(chunks()) is None
+
+    def test_missing_div(self):
+        """Test that None is returned when the div is absent."""
+        chunks = [b'<html><body><div id="other">No data here</div></body></html>']
+
+        assert update_calendar.find_fundraisers_attr(chunks) is None
 
 
 class TestReadExistingIcs:
@@ -169,12 +367,51 @@ END:VCALENDAR"""
 
         mocker.patch('builtins.open', mock_open(read_data=mock_ics_content))
 
-        content, uids = update_calendar.read_existing_ics()
+        content, dates = update_calendar.read_existing_ics()
+
+        assert content == mock_ics_content.replace('\n', '\r\n') + '\r\n'
+        assert dates == ['20250103', '20250207']
+
+    def test_read_existing_ics_ignores_foreign_uids(self, mocker):
+        """Test that UIDs not generated by this script are skipped."""
+        mock_ics_content = """BEGIN:VCALENDAR\r
+BEGIN:VEVENT\r
+UID:bandcamp-friday-20250103@github.com\r
+END:VEVENT\r
+BEGIN:VEVENT\r
+UID:bandcamp-friday-2025-01-03@example.com\r
+END:VEVENT\r
+BEGIN:VEVENT\r
+UID:someone-else@example.com\r
+END:VEVENT\r
+END:VCALENDAR\r
+"""
+
+        mocker.patch('builtins.open', mock_open(read_data=mock_ics_content))
+
+        content, dates = update_calendar.read_existing_ics()
+
+        assert dates == ['20250103']
+
+    def test_read_existing_ics_duplicate_uids(self, mocker):
+        """Test that duplicate UIDs are reported once, in file order."""
+        mock_ics_content = """BEGIN:VCALENDAR
+BEGIN:VEVENT
+UID:bandcamp-friday-20250207@github.com
+END:VEVENT
+BEGIN:VEVENT
+UID:bandcamp-friday-20250103@github.com
+END:VEVENT
+BEGIN:VEVENT
+UID:bandcamp-friday-20250207@github.com
+END:VEVENT
+END:VCALENDAR"""
+
+        mocker.patch('builtins.open', mock_open(read_data=mock_ics_content))
+
+        content, dates = update_calendar.read_existing_ics()
 
-        assert content == mock_ics_content
-        assert len(uids) == 2
-        assert 'bandcamp-friday-20250103@github.com' in uids
-        assert 'bandcamp-friday-20250207@github.com' in uids
+        assert dates == ['20250207', '20250103']
 
     def test_read_existing_ics_no_events(self, mocker):
         """Test reading ICS file with no events."""
@@ -184,19 +421,54 @@ END:VCALENDAR"""
 
         mocker.patch('builtins.open', mock_open(read_data=mock_ics_content))
 
-        content, uids = update_calendar.read_existing_ics()
+        content, dates = update_calendar.read_existing_ics()
+
+        assert content == 'BEGIN:VCALENDAR\r\nVERSION:2.0\r\nEND:VCALENDAR\r\n'
+        assert dates == []
+
+    def test_read_existing_ics_normalizes_line_endings(self, mocker):
+        """Test that mixed line endings come back as CRLF."""
+        mock_ics_content = "BEGIN:VCALENDAR\nVERSION:2.0\r\nUID:bandcamp-friday-20250103@github.com\r\nEND:VCALENDAR\n"
 
-        assert content == mock_ics_content
-        assert uids == []
+        mocker.patch('builtins.open', mock_open(read_data=mock_ics_content))
+
+        content, dates = update_calendar.read_existing_ics()
+
+        assert content == (
+            'BEGIN:VCALENDAR\r\n'
+            'VERSION:2.0\r\n'
+            'UID:bandcamp-friday-20250103@github.com\r\n'
+            'END:VCALENDAR\r\n'
+        )
+        assert dates == ['20250103']
+
+    def test_read_existing_ics_empty_file(self, mocker):
+        """Test that an empty file reads as empty content."""
+        mocker.patch('builtins.open', mock_open(read_data=''))
+
+        content, dates = update_calendar.read_existing_ics()
+
+        assert content == ''
+        assert dates == []
+
+    def test_read_existing_ics_utf8(self, mocker, tmp_path):
+        """Test that the calendar is decoded as UTF-8 whatever the locale."""
+        ics_file = tmp_path / 'bandcamp-friday.ics'
+        ics_file.write_bytes('BEGIN:VCALENDAR\r\nX-WR-CALDESC:Café\r\nEND:VCALENDAR\r\n'.encode('utf-8'))
+        mocker.patch('update_calendar.ICS_FILE', str(ics_file))
+
+        content, _ = update_calendar.read_existing_ics()
+
+        assert 'X-WR-CALDESC:Café\r\n' in content
 
     def test_read_existing_ics_file_not_found(self, mocker):
         """Test handling when ICS file doesn't exist."""
         mocker.patch('builtins.open', side_effect=FileNotFoundError)
 
-        content, uids = update_calendar.read_existing_ics()
+        content, dates = update_calendar.read_existing_ics()
 
         assert content is None
-        assert uids == []
+        assert dates == []
 
 
 class TestGenerateVevent:
@@ -230,6 +502,12 @@ class TestGenerateVevent:
         assert 'DESCRIPTION:Bandcamp waives its revenue share on this day. Support artists\r\n' in vevent
         assert '  directly!' in vevent  # Continuation line with single space
 
+    def test_generate_vevent_explicit_dtstamp(self):
+        """Test that a supplied DTSTAMP is used instead of the clock."""
+        vevent = update_calendar.generate_vevent('20251003', '20250101T120000Z')
+
+        assert 'DTSTAMP:20250101T120000Z\r\n' in vevent
+
     def test_generate_vevent_unique_uid(self):
         """Test that different dates generate unique UIDs."""
         vevent1 = update_calendar.generate_vevent('20251003')
@@ -265,7 +543,7 @@ END:VCALENDAR\r
         # Check that file was written
         handle = mock_file()
         handle.write.assert_called_once()
-        written_content = handle.write.call_args[0][0]
+        written_content = handle.write.call_args[0][0].decode('utf-8')
 
         # Should contain normalized line endings
         assert '\r\n' in written_content
@@ -289,6 +567,20 @@ END:VCALENDAR\r
         captured = capsys.readouterr()
         assert 'No new dates to add' in captured.out
 
+    def test_update_ics_file_no_new_dates_skips_rebuild(self, mocker):
+        """Test that a scraped subset of existing, in-order dates writes nothing."""
+        mocker.patch('update_calendar.read_existing_ics',
+                     return_value=('BEGIN:VCALENDAR\r\nEND:VCALENDAR\r\n',
+                                   ['20250103', '20250207', '20250307']))
+        mock_generate = mocker.patch('update_calendar.generate_vevent')
+        mock_file = mock_open()
+        mocker.patch('builtins.open', mock_file)
+
+        update_calendar.update_ics_file(['20250207'])
+
+        mock_generate.assert_not_called()
+        mock_file.assert_not_called()
+
     def test_update_ics_file_create_new(self, mocker):
         """Test creating new ICS file from scratch."""
         mocker.patch('builtins.open', side_effect=[
@@ -322,7 +614,7 @@ END:VCALENDAR\r
         mock_file = mock_open(read_data=existing_ics)
         generated_events = []
 
-        def mock_generate(date):
+        def mock_generate(date, dtstamp):
             event = f'EVENT_{date}'
             generated_events.append(date)
             return event
@@ -357,7 +649,7 @@ END:VCALENDAR\r
         mocker.patch('builtins.open', mock_file)
 
         generated_dates = []
-        def track_generate(date):
+        def track_generate(date, dtstamp):
             generated_dates.append(date)
             return f'EVENT_{date}'
 
@@ -392,7 +684,7 @@ END:VCALENDAR\r
         update_calendar.update_ics_file(['20250103', '20250207'])
 
         handle = mock_file()
-        written_content = handle.write.call_args[0][0]
+        written_content = handle.write.call_args[0][0].decode('utf-8')
 
         # Check header elements are preserved
         assert 'BEGIN:VCALENDAR\r\n' in written_content
@@ -400,6 +692,75 @@ END:VCALENDAR\r
         assert 'PRODID:-//Custom Producer//EN\r\n' in written_content
         assert 'BEGIN:VTIMEZONE\r\n' in written_content
 
+    def test_update_ics_file_no_existing_events(self, mocker):
+        """Test adding events to a calendar that has a header but no events."""
+        existing_ics = """BEGIN:VCALENDAR\r
+VERSION:2.0\r
+X-WR-CALDESC:Mentions END:VCALENDAR in passing\r
+END:VCALENDAR\r
+"""
+
+        mock_file = mock_open(read_data=existing_ics)
+        mocker.patch('builtins.open', mock_file)
+        mocker.patch('update_calendar.generate_vevent', return_value='MOCK_EVENT')
+
+        update_calendar.update_ics_file(['20250103'])
+
+        written_content = mock_file().write.call_args[0][0].decode('utf-8')
+
+        assert written_content == (
+            'BEGIN:VCALENDAR\r\n'
+            'VERSION:2.0\r\n'
+            'X-WR-CALDESC:Mentions END:VCALENDAR in passing\r\n'
+            'MOCK_EVENT\r\n'
+            'END:VCALENDAR\r\n'
+        )
+
+    def test_update_ics_file_shared_dtstamp(self, mocker):
+        """Test that every event in a rewrite shares a single DTSTAMP."""
+        mocker.patch('builtins.open', mock_open())
+        mocker.patch('update_calendar.read_existing_ics', return_value=(None, []))
+        mock_dtstamp = mocker.patch('update_calendar.current_dtstamp', return_value='20250101T120000Z')
+        mock_generate = mocker.patch('update_calendar.generate_vevent', return_value='MOCK_EVENT')
+
+        update_calendar.update_ics_file(['20250103', '20250207', '20250307'])
+
+        mock_dtstamp.assert_called_once()
+        assert [c.args for c in mock_generate.call_args_list] == [
+            ('20250103', '20250101T120000Z'),
+            ('20250207', '20250101T120000Z'),
+            ('20250307', '20250101T120000Z'),
+        ]
+
+    def test_update_ics_file_atomic_replace(self, mocker, mock_fsync, mock_replace):
+        """Test that the calendar is written to a temp file and renamed into place."""
+        mock_file = mock_open()
+        mocker.patch('builtins.open', mock_file)
+        mocker.patch('update_calendar.read_existing_ics', return_value=(None, []))
+        mocker.patch('update_calendar.generate_vevent', return_value='MOCK_EVENT')
+
+        update_calendar.update_ics_file(['20250103'])
+
+        tmp_file = f'{update_calendar.ICS_FILE}.tmp'
+        assert mock_file.call_args.args[:2] == (tmp_file, 'wb')
+        assert isinstance(mock_file().write.call_args[0][0], bytes)
+        mock_fsync.assert_called_once_with(mock_file().fileno())
+        mock_replace.assert_called_once_with(tmp_file, update_calendar.ICS_FILE)
+
+    @pytest.mark.parametrize('failing', ['update_calendar.os.fsync', 'update_calendar.os.replace'])
+    def test_update_ics_file_removes_temp_file_on_failure(self, mocker, failing):
+        """Test that a failed write or rename removes the temp file and re-raises."""
+        mocker.patch('builtins.open', mock_open())
+        mocker.patch('update_calendar.read_existing_ics', return_value=(None, []))
+        mocker.patch('update_calendar.generate_vevent', return_value='MOCK_EVENT')
+        mocker.patch(failing, side_effect=OSError("disk full"))
+        mock_unlink = mocker.patch('update_calendar.os.unlink')
+
+        with pytest.raises(OSError, match="disk full"):
+            update_calendar.update_ics_file(['20250103'])
+
+        mock_unlink.assert_called_once_with(f'{update_calendar.ICS_FILE}.tmp')
+
 
 class TestLineEndingNormalization:
     """Tests for line ending handling."""
@@ -418,7 +779,7 @@ class TestLineEndingNormalization:
         update_calendar.update_ics_file(['20250103', '20250207'])
 
         handle = mock_file()
-        written_content = handle.write.call_args[0][0]
+        written_content = handle.write.call_args[0][0].decode('utf-8')
 
         # Should be normalized to CRLF
         assert '\r\n' in written_content
@@ -443,11 +804,7 @@ class TestIntegration:
         </html>
         '''
 
-        mock_response = Mock()
-        mock_response.content = mock_html.encode()
-        mock_response.raise_for_status = Mock()
-
-        mocker.patch('update_calendar.requests.get', return_value=mock_response)
+        mocker.patch('update_calendar.SESSION.get', return_value=FakeResponse(mock_html.encode()))
 
         # Mock file operations
         mock_file = mock_open(read_data='')
@@ -461,7 +818,7 @@ class TestIntegration:
         mocker.patch('update_calendar.datetime.datetime', mock_datetime)
 
         # Run the scrape
-        dates = update_calendar.scrape_dates()
+        dates, _ = update_calendar.scrape_dates()
 
         assert len(dates) == 2
         assert '20251003' in dates